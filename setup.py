@@ -55,6 +55,7 @@ setuptools.setup(
         'absl-py',
         'numpy',
         # 'jax',  # Optional
+        # 'numba',  # Optional
     ],
     include_package_data=True,  # Using the files specified in MANIFEST.in
 )
\ No newline at end of file
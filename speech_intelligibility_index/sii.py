@@ -49,6 +49,19 @@ mid_band_freqs = [160, 200, 250, 315, 400, 500, 630, 800, 1000, 1250, 1600,
 bandwidth_db = np.arange(15.65, 33.65, 1.0)  # Column 3
 bandwidth_hz = 10**(bandwidth_db/10)
 
+# Band center frequencies for the 1/3rd octave procedure (Table 3)
+_F = np.array([160, 200, 250, 315, 400, 500, 630, 800, 1000, 1250, 1600, 2000,
+               2500, 3150, 4000, 5000, 6300, 8000])
+
+# Internal Noise Spectrum Level (Table 3)
+_X = np.array([0.6, -1.7, -3.9, -6.1, -8.2, -9.7, -10.8, -11.9, -12.5,
+               -13.5, -15.4, -17.7, -21.2, -24.2, -25.9, -23.6, -15.8, -7.1])
+
+# Spread of masking from band j into band i (4.3.2.5 Eq. 9). Only the lower
+# bands j < i contribute, so everything on and above the diagonal is masked.
+_LOWER_MASK = np.tri(18, 18, k=-1, dtype=bool)
+_MIJ = np.where(_LOWER_MASK, 3.32*np.log10(0.89*_F[:, None]/_F[None, :]), 0)
+
 
 def speech_spectrum(vocal_effort: str) -> np.ndarray:
   """"This function returns the standard speech spectrum level from Table 3.
@@ -99,9 +112,13 @@ def speech_spectrum(vocal_effort: str) -> np.ndarray:
     raise ValueError(f'Identifier string {vocal_effort} not recognized')
 
 
+# Reference for the Level Distortion Factor (4.6 Eq. 11)
+_NORMAL_SPECTRUM = speech_spectrum('normal')
+
+
 band_importance_names = ['standard',  # Table 3
                          'nns', 'cid-22', 'nu6',  # All the rest from Table B.2
-                         'drt', 'spin', 'short', 'spin', 'cst']
+                         'drt', 'short', 'spin', 'cst']
 
 
 def band_importance(test_number: Union[int, List[float], str,
@@ -136,7 +153,7 @@ def band_importance(test_number: Union[int, List[float], str,
       raise ValueError(f'Test name {test_number} not recognized, should be '
                        f'one of: {band_importance_names}')
     else:
-      test_number = band_importance_names.index(test_number)
+      test_number = band_importance_names.index(test_number) + 1
 
   if isinstance(test_number, int):
     if test_number < 1 or test_number > 8:
@@ -218,6 +235,8 @@ def input_5p1(ssl, nsl=None, insertion_gain=None,
             parameter is valid only when ssl is specified as one of the named
             vocal efforts, i.e., according to clause (a) in the specification
             of "SSL"; it will be ignored otherwise.
+            A vector of N distances gives Nx18 results, one row per
+            distance.
 
     hearing_threshold: [dB HL] Section 3.22
             A vector with 18 numbers stating the Hearing Threshold Levels in
@@ -230,37 +249,48 @@ def input_5p1(ssl, nsl=None, insertion_gain=None,
             listening mode: b = 1 --> monaural listening, b = 2 --> binaural
             listening. Monaural listening is the default.
 
+  The spectra may also be given as arrays with leading batch dimensions,
+  e.g. Nx18 with one listening condition per row. They are broadcast against
+  each other.
+
   Returns:
     A tuple of three numpy arrays giving the speech spectrum level (ssl),
     noise spectrum level (msl) and hearing_threshold.
   """
-  if not ssl:
+  if ssl is None:
     raise ValueError('The Speech Spectrum Level, ssl, must be specified')
 
   if isinstance(ssl, str):
     ssl = speech_spectrum(ssl)  # Standard spectra are used
-    distance = distance or 1.0  # Reference communication situation assumed
+    if distance is None:
+      distance = 1.0  # Reference communication situation assumed
+    # A vector of distances gives one row of levels per distance.
+    distance = np.asarray(distance, dtype=float)[..., None]
+    if not np.all(distance > 0):
+      raise ValueError('The distance must be positive!')
+    ssl = ssl - 20*np.log10(distance)
     if insertion_gain is None:
-      insertion_gain = np.zeros(18)
-    ssl = ssl - 20*np.log10(distance) + insertion_gain  # Eq. 16
+      insertion_gain = np.zeros_like(ssl)
+    ssl = ssl + insertion_gain  # Eq. 16
   else:
     ssl = np.asarray(ssl)  # Speech Spectrum measured at listener's head
     if insertion_gain is None:
-      insertion_gain = np.zeros(18)
+      insertion_gain = np.zeros_like(ssl)
     ssl = ssl + insertion_gain  # Eq. 17
-    if distance:
+    if distance is not None:
       warnings.warn('Distance parameter is inappropriately '
                     'specified and ignored!')
+  insertion_gain = np.asarray(insertion_gain)
 
   # DERIVE EQUIVALENT NOISE SPECTRUM LEVEL
   if nsl is None:
-    nsl = -50*np.ones(18)
+    nsl = -50*np.ones_like(ssl)
   else:
-    nsl = np.asarray(nsl) + np.asarray(insertion_gain)  # Eq. 18
+    nsl = np.asarray(nsl) + insertion_gain  # Eq. 18
 
   # DERIVE EQUIVALENT HEARING THRESHOLD LEVEL
   if hearing_threshold is None:
-    hearing_threshold = np.zeros(18)
+    hearing_threshold = np.zeros_like(ssl)
   else:
     hearing_threshold = np.asarray(hearing_threshold)
 
@@ -268,8 +298,13 @@ def input_5p1(ssl, nsl=None, insertion_gain=None,
     raise ValueError('Invalid value of num_channels specified!')
 
   if num_channels == 2:                                # Binaural listening
-    hearing_threshold -= 1.7                           # Section 5.1.5
+    hearing_threshold = hearing_threshold - 1.7        # Section 5.1.5
 
+  # Give all three spectra the same (batch) shape. Broadcasting returns views
+  # that can share memory between rows or with the caller's arrays, so copy
+  # them into independent arrays.
+  ssl, nsl, hearing_threshold = [
+      np.array(x) for x in np.broadcast_arrays(ssl, nsl, hearing_threshold)]
   return (ssl, nsl, hearing_threshold)
 
 
@@ -496,9 +531,15 @@ def sii(ssl, nsl=None, hearing_threshold=None,
         Non_standard
         8: CST (Table 1 of Sherbecoe and Studebaker, Ear and Hearing 2003)
 
+  The three spectra may also be given as arrays with leading batch
+  dimensions, e.g. Nx18 with one listening condition per row. They are
+  broadcast against each other, so a single 18-element nsl or
+  hearing_threshold can be shared by all conditions.
+
   Returns:
     The function returns the SII of the specified listening condition, which
-    is a value in the interval [0, 1].
+    is a value in the interval [0, 1]. For batched spectra, an array of SII
+    values with the broadcast batch shape is returned.
 
   REMINDER OF DEFINITIONS & MEANINGS:
 
@@ -548,27 +589,20 @@ def sii(ssl, nsl=None, hearing_threshold=None,
   else:
     hearing_threshold = np.asarray(hearing_threshold)
 
-  if nsl.shape != (18,):
+  if nsl.shape[-1:] != (18,):
     raise ValueError('Equivalent Noise Spectrum Level: Vector size incorrect')
-  if hearing_threshold.shape != (18,):
+  if hearing_threshold.shape[-1:] != (18,):
     raise ValueError('Equivalent Hearing Threshold Level: '
                      'Vector size incorrect')
-  if ssl.shape != (18,):
+  if ssl.shape[-1:] != (18,):
     raise ValueError('Equivalent Speech Spectrum Level: Vector size incorrect')
+  importance = band_importance(band_importance_function)
 
   ################# IMPLEMENTATION OF SPEECH INTELLIGIBILITY INDEX ############
 
   # THE NUMBERS IN PARENTHESIS REFER TO THE SECTIONS IN THE ANSI STANDARD
   # pylint: disable=invalid-name  # variable names are from the standard
 
-  # Define band center frequencies for 1/3rd octave procedure (Table 3)
-  f = np.array([160, 200, 250, 315, 400, 500, 630, 800, 1000, 1250, 1600, 2000,
-                2500, 3150, 4000, 5000, 6300, 8000])
-
-  # Define Internal Noise Spectrum Level (Table 3)
-  X = np.array([0.6, -1.7, -3.9, -6.1, -8.2, -9.7, -10.8, -11.9, -12.5,
-                -13.5, -15.4, -17.7, -21.2, -24.2, -25.9, -23.6, -15.8, -7.1])
-
   # Self-Speech Masking Spectrum (4.3.2.1 Eq. 5)
   V = ssl - 24
 
@@ -576,25 +610,24 @@ def sii(ssl, nsl=None, hearing_threshold=None,
   B = np.maximum(V, nsl)
 
   # Calculate slope parameter Ci (4.3.2.3 Eq. 7)
-  C = 0.6*(B + 10*np.log10(f) - 6.353) - 80
+  C = 0.6*(B + 10*np.log10(_F) - 6.353) - 80
 
+  # Calculate Equivalent Masking Spectrum Level (4.3.2.5 Eq. 9) for all bands
+  # at once. Row i of the masking matrix holds the spread of masking into band
+  # i from each of the lower bands j < i; all other entries are masked out.
+  contrib = 10**(0.1*(B[..., None, :] + C[..., None, :]*_MIJ)) * _LOWER_MASK
+  Z = 10*np.log10(10**(0.1*nsl) + np.sum(contrib, axis=-1))
   # Initialize Equivalent Masking Spectrum Level (4.3.2.4)
-  Z = np.zeros(18)
-  Z[0] = B[0]
-
-  # Calculate Equivalent Masking Spectrum Level (4.3.2.5 Eq. 9)
-  for i in range(1, 18):
-    Z[i] = 10*np.log10(10**(0.1*nsl[i]) +
-                       np.sum(10**(0.1*(B[:i] + 3.32*C[:i]*
-                                        np.log10(0.89*f[i]/f[:i])))))
+  Z[..., 0] = B[..., 0]
+
   # Equivalent Internal Noise Spectrum Level (4.4 Eq. 10)
-  X = X + hearing_threshold
+  X = _X + hearing_threshold
 
   # Disturbance Spectrum Level (4.5)
   D = np.maximum(Z, X)
 
   # Level Distortion Factor (4.6 Eq. 11)
-  L = 1 - (ssl - speech_spectrum('normal') - 10)/160
+  L = 1 - (ssl - _NORMAL_SPECTRUM - 10)/160
   L = np.minimum(1, L)
 
   # 4.7.1 Eq. 12
@@ -605,4 +638,4 @@ def sii(ssl, nsl=None, hearing_threshold=None,
   A = L*K
 
   # Speech Intelligibility Index (4.8 Eq. 14)
-  return np.sum(band_importance(band_importance_function)*A)
\ No newline at end of file
+  return np.einsum('...i,i->...', A, importance)
\ No newline at end of file
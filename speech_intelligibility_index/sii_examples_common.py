@@ -0,0 +1,269 @@
+# Copyright 2023 The speech_intelligibility_index Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reference examples from the ANSI standard, shared by the SII tests.
+
+The examples are run against both the NumPy (sii.py) and the JAX (sii_jax.py)
+implementations. Each test file mixes ExampleMixin into its test case and
+names the module to test with the sii_module class attribute.
+The Matlab results for the Section 5 procedures, and
+assert_spectra_allclose to check them, are shared here too.
+
+The example sweeps are the slowest tests. Set the environment variable
+SII_SKIP_SLOW=1 to skip them while iterating on the code, e.g.
+  SII_SKIP_SLOW=1 python -m pytest
+
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import types
+from typing import Optional
+
+from absl.testing import absltest
+import matplotlib
+matplotlib.use('Agg')  # Render to files only; the tests need no display.
+import matplotlib.pyplot as plt  # pylint: disable=g-import-not-at-top
+import numpy as np
+
+
+# Example 1: distances from 0.5m to 20m by 0.5m.
+_DISTANCES = np.arange(0.5, 20.1, 0.5)
+# Example 2: relative spectral density level of white noise (a flat spectrum)
+_N = np.zeros(18)
+# ... and the absolute spectral density levels it is played at.
+_ABS_LEVELS = np.arange(0, 80.1, 2)
+# The grids are shared by the tests, so guard them against modification.
+_DISTANCES.setflags(write=False)
+_N.setflags(write=False)
+_ABS_LEVELS.setflags(write=False)
+
+# Expected results from the Matlab commands Example1 and Example2.
+# pylint: disable=line-too-long,bad-whitespace  # Match Matlab output.
+_EXPECTED_SS = np.array([
+    0.8809, 0.9177, 0.9386, 0.9522, 0.9623, 0.9705, 0.9768, 0.9819, 0.9865, 0.9899,
+    0.9928, 0.9949, 0.9967, 0.9977, 0.9979, 0.9975, 0.9970, 0.9966, 0.9962, 0.9958,
+    0.9954, 0.9950, 0.9947, 0.9943, 0.9940, 0.9937, 0.9934, 0.9931, 0.9929, 0.9926,
+    0.9924, 0.9921, 0.9919, 0.9916, 0.9914, 0.9912, 0.9909, 0.9906, 0.9903, 0.9900])
+
+_EXPECTED_SN = np.array([
+    1.0000, 0.9969, 0.9947, 0.9920, 0.9885, 0.9856, 0.9831, 0.9810, 0.9791, 0.9775,
+    0.9760, 0.9746, 0.9722, 0.9698, 0.9677, 0.9657, 0.9638, 0.9619, 0.9600, 0.9583,
+    0.9567, 0.9551, 0.9532, 0.9508, 0.9477, 0.9434, 0.9380, 0.9322, 0.9266, 0.9203,
+    0.9143, 0.9084, 0.9024, 0.8962, 0.8901, 0.8844, 0.8788, 0.8733, 0.8680, 0.8627])
+
+_EXPECTED_SPEECH = np.array([
+    0.9177, 0.9177, 0.9177, 0.9173, 0.9161, 0.9126, 0.9092, 0.9035, 0.8967, 0.8894,
+    0.8795, 0.8672, 0.8508, 0.8306, 0.8070, 0.7790, 0.7482, 0.7073, 0.6565, 0.5960,
+    0.5372, 0.4783, 0.4225, 0.3669, 0.3117, 0.2604, 0.2105, 0.1657, 0.1250, 0.0865,
+    0.0534, 0.0245, 0.0062, 0,      0,      0,      0,      0,      0,      0,
+    0])
+
+_EXPECTED_PROTECTION = np.array([
+    0.9400, 0.9400, 0.9400, 0.9400, 0.9400, 0.9400, 0.9400, 0.9400, 0.9400, 0.9384,
+    0.9327, 0.9240, 0.9116, 0.8942, 0.8715, 0.8457, 0.8164, 0.7780, 0.7277, 0.6624,
+    0.5988, 0.5352, 0.4738, 0.4138, 0.3542, 0.2973, 0.2432, 0.1943, 0.1498, 0.1082,
+    0.0709, 0.0367, 0.0126, 0,      0,      0,      0,      0,      0,      0,
+    0])
+# pylint: enable=line-too-long,bad-whitespace
+
+# Matlab results for the Section 5 procedures, see the tests for the calls.
+MATLAB_SSL_5P1 = np.array([32.4100, 34.4800, 34.7500, 33.9800, 34.5900,
+                           34.2700, 32.0600, 28.3000, 25.0100, 23.0000,
+                           20.1500, 17.3200, 13.1800, 11.5500, 9.3300,
+                           5.3100, 2.5900, 1.1300])
+MATLAB_SSL_5P3 = np.array([49.8648, 49.3648, 48.8648, 48.4648, 48.3648,
+                           48.0648, 47.4648, 46.7648, 47.2648, 46.8648,
+                           43.7648, 37.8648, 33.0648, 34.8648, 35.5648,
+                           39.1648, 43.4648, 48.0648])
+MATLAB_NSL_5P3 = np.array([34.8648, 34.3648, 33.8648, 33.4648, 33.3648,
+                           33.0648, 32.4648, 31.7648, 32.2648, 31.8648,
+                           28.7648, 22.8648, 18.0648, 19.8648, 20.5648,
+                           24.1648, 28.4648, 33.0648])
+MATLAB_SSL_5P1.setflags(write=False)
+MATLAB_SSL_5P3.setflags(write=False)
+MATLAB_NSL_5P3.setflags(write=False)
+
+# The 5.2 and 5.3 inputs: a 50 dB combined spectrum and a flat, unity MTF.
+# They are read-only, which also checks that the procedures do not modify
+# their arguments.
+CSNS_50 = np.full(18, 50.0)
+MTF_ONES = np.ones((18, 9))
+CSNS_50.setflags(write=False)
+MTF_ONES.setflags(write=False)
+
+
+def assert_spectra_allclose(actual, expected, atol: float = 1e-4):
+  """Compares the (ssl, nsl, hearing_threshold) tuples of a Section 5 test.
+
+  Args:
+    actual: The three 18-band spectra returned by one of the input_5p*
+      procedures.
+    expected: The three reference spectra.
+    atol: The absolute tolerance, as for np.testing.assert_allclose.
+
+  Raises:
+    AssertionError: if any band differs. The message names the spectrum.
+  """
+  for name, actual_spectrum, expected_spectrum in zip(
+      ('ssl', 'nsl', 'hearing_threshold'), actual, expected):
+    np.testing.assert_allclose(actual_spectrum, expected_spectrum, atol=atol,
+                               err_msg=f'Mismatched spectrum: {name}')
+
+
+_SKIP_SLOW = bool(os.environ.get('SII_SKIP_SLOW'))
+
+
+class ExampleMixin:
+  """Examples 1 and 2, for a test case that sets sii_module."""
+
+  sii_module: Optional[types.ModuleType] = None
+
+  def sii_sweep(self, ssl, nsl, hearing_threshold=None):
+    """Computes the SII of a sweep of conditions, one row per condition.
+
+    Test cases can override this to use a dedicated batched entry point.
+
+    Args:
+      ssl: Equivalent Speech Spectrum Levels, an Nx18 array.
+      nsl: Equivalent Noise Spectrum Levels, an Nx18 array.
+      hearing_threshold: Equivalent Hearing Threshold Levels, an Nx18 array,
+        or None for the default.
+
+    Returns:
+      A vector with the N SII values.
+    """
+    return self.sii_module.sii(ssl=ssl, nsl=nsl,
+                               hearing_threshold=hearing_threshold)
+
+  def example_1(self, plot: bool = False):
+    sii = self.sii_module
+    # Example 1:
+    #
+    # Talker and listener are facing each other in a free field. There is no
+    # background noise. Calculate the SII as a function of the distance between
+    # the talker and the listener.
+    #
+    # Assumptions:
+    # Talking effort: "normal" and "shouted" speech
+    # Importance function of "average speech" (default)
+    # Hearing threshold is 0dB HL (normal hearing -- default)
+    num_channels = 2                  # binaural listening
+    distances = _DISTANCES
+
+    # Each call covers all distances at once, one row per distance.
+    # Normal vocal effort
+    [ssl, nsl, hearing_threshold] = sii.input_5p1(ssl='normal',
+                                                  num_channels=num_channels,
+                                                  distance=distances)
+    sn_sii = self.sii_sweep(ssl, nsl, hearing_threshold)
+
+    # Shouted speech
+    [ssl, nsl, hearing_threshold] = sii.input_5p1(ssl='shout',
+                                                  num_channels=num_channels,
+                                                  distance=distances)
+    ss_sii = self.sii_sweep(ssl, nsl, hearing_threshold)
+
+    if plot:
+      plt.figure()
+      plt.plot(distances, sn_sii, 'o-b')
+      plt.plot(distances, ss_sii, 'x-r')
+      plt.grid(True)
+      plt.title('SII in quiet free-field')
+      plt.xlabel('Distance between talker and listener [m]')
+      plt.ylabel('SII')
+      plt.legend(('normal vocal effort', 'shouted speech'))
+      plt.axis([0.4, 20.1, 0, 1])
+
+      plt.savefig('/tmp/example1.png')
+    return ss_sii, sn_sii
+
+  @absltest.skipIf(_SKIP_SLOW, 'SII_SKIP_SLOW is set')
+  def test_example_1(self):
+    ss_sii, sn_sii = self.example_1()
+    np.testing.assert_allclose(np.asarray(ss_sii), _EXPECTED_SS, atol=1e-4)
+    np.testing.assert_allclose(np.asarray(sn_sii), _EXPECTED_SN, atol=1e-4)
+
+  def example_2(self, plot: bool = False):
+    sii = self.sii_module
+    # Example 2
+    #
+    # Consider the following communication situation:
+    # A talker and a listener face each other and are 1m appart. There is a
+    # background of white noise and the talker shouts.
+    # Calculate the SII for this communication situation as a function of
+    # noise level when the listener wears hearing protection and when he
+    # does not wear hearing protection.
+    #
+    # Assumptions:
+    # Attenuation of Elvex Blue (TM) Foam Ear Plugs as listed on the companie's
+    # web site (interpolated onto standard 1/3 oct band frequencies)
+
+    # pylint: disable=invalid-name  # Use variable names in ANSI standard.
+    A = np.array([36.1, 37.0, 38.0, 37.7, 37.4, 37.2, 37.0, 36.9, 36.7, 36.4,
+                  36.1, 35.8, 38.0, 40.3, 40.7, 41.0, 41.5, 42.5])  # dB
+
+    # White noise at each absolute spectral density level.
+    N = _N
+    absolute_levels = _ABS_LEVELS
+
+    # binaural listening.
+    b = 2
+
+    # All noise levels are evaluated at once, one row per level. input_5p1
+    # broadcasts the speech levels and the insertion gain over the rows.
+    # No hearing protection
+    [ssl, nsl, _] = sii.input_5p1(ssl='shout', num_channels=b,
+                                  nsl=N+absolute_levels[:, None])
+    shout_sii = self.sii_sweep(ssl, nsl)
+
+    # With hearing protection
+    [ssl, nsl, _] = sii.input_5p1(ssl='shout', num_channels=b,
+                                  nsl=absolute_levels[:, None],
+                                  insertion_gain=-A)
+    protected_sii = self.sii_sweep(ssl, nsl)
+
+    if plot:
+      plt.figure()
+      plt.plot(absolute_levels, shout_sii, 'o-b')
+      plt.plot(absolute_levels, protected_sii, 'x-r')
+      plt.grid(True)
+      plt.title('SII in noise with and w/o hearing protection')
+      plt.xlabel('Spectral Density Level of White Noise [dB]')
+      plt.ylabel('SII')
+      plt.legend(('No hearing protection', 'Foam Ear Plugs'))
+      plt.axis([0, 80, 0, 1])
+      plt.savefig('/tmp/example2.png')
+
+    return shout_sii, protected_sii
+
+  @absltest.skipIf(_SKIP_SLOW, 'SII_SKIP_SLOW is set')
+  def test_example_2(self):
+    shout_sii, protected_sii = self.example_2()
+    np.testing.assert_allclose(np.asarray(shout_sii), _EXPECTED_SPEECH,
+                               atol=1e-4)
+    np.testing.assert_allclose(np.asarray(protected_sii), _EXPECTED_PROTECTION,
+                               atol=1e-4)
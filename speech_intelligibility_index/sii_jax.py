@@ -36,9 +36,13 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from typing import List, Tuple, Union
+import functools
+import math
+import os
+from typing import List, Optional, Tuple, Union
 import warnings
 
+import jax
 import jax.numpy as jnp
 import numpy as np
 
@@ -50,6 +54,63 @@ mid_band_freqs = [160, 200, 250, 315, 400, 500, 630, 800, 1000, 1250, 1600,
 bandwidth_db = np.arange(15.65, 33.65, 1.0)  # Column 3
 bandwidth_hz = 10**(bandwidth_db/10)
 
+# Band center frequencies for the 1/3rd octave procedure (Table 3)
+_F = jnp.array([160, 200, 250, 315, 400, 500, 630, 800, 1000, 1250, 1600, 2000,
+                2500, 3150, 4000, 5000, 6300, 8000],
+               dtype=jnp.float32)
+
+# Internal Noise Spectrum Level (Table 3)
+_X = jnp.array([0.6, -1.7, -3.9, -6.1, -8.2, -9.7, -10.8, -11.9, -12.5,
+                -13.5, -15.4, -17.7, -21.2, -24.2, -25.9, -23.6, -15.8, -7.1],
+               dtype=jnp.float32)
+
+# Spread of masking from band j into band i (4.3.2.5 Eq. 9). Only the lower
+# bands j < i contribute, so everything on and above the diagonal is masked.
+_LOWER_MASK = jnp.tri(18, 18, k=-1, dtype=bool)
+_MIJ = jnp.where(_LOWER_MASK, 3.32*jnp.log10(0.89*_F[:, None]/_F[None, :]), 0)
+# The same mask in the log-power domain: adding 0 keeps a term and adding -inf
+# removes it from the logsumexp, without a select in the compiled kernel.
+_LOG_LOWER_MASK = jnp.where(_LOWER_MASK, 0, -jnp.inf).astype(jnp.float32)
+
+_LOG10 = math.log(10.0)
+_INV_LOG10 = 1.0/_LOG10
+
+
+def _from_db(x):
+  """Converts a level in dB to a power ratio, using exp instead of 10**x."""
+  return jnp.exp((0.1*_LOG10)*x)
+
+
+def _to_db(x):
+  """Converts a power ratio to a level in dB, using log instead of log10."""
+  return (10.0*_INV_LOG10)*jnp.log(x)
+
+
+# pylint: disable=bad-whitespace  # To make it easier to read columns
+# This is table 3 from the ANSI standard
+_EI = jnp.array([[32.41, 33.81, 35.29, 30.77],
+                 [34.48, 33.92, 37.76, 36.65],
+                 [34.75, 38.98, 41.55, 42.5],
+                 [33.98, 38.57, 43.78, 46.51],
+                 [34.59, 39.11, 43.3,  47.4],
+                 [34.27, 40.15, 44.85, 49.24],
+                 [32.06, 38.78, 45.55, 51.21],
+                 [28.3,  36.37, 44.05, 51.44],
+                 [25.01, 33.86, 42.16, 51.31],
+                 [23,    31.89, 40.53, 49.63],
+                 [20.15, 28.58, 37.7,  47.65],
+                 [17.32, 25.32, 34.39, 44.32],
+                 [13.18, 22.35, 30.98, 40.8],
+                 [11.55, 20.15, 28.21, 38.13],
+                 [9.33,  16.78, 25.41, 34.41],
+                 [5.31,  11.47, 18.35, 28.24],
+                 [2.59,   7.67, 13.87, 23.45],
+                 [1.13,   5.07, 11.39, 20.72]],
+                dtype=jnp.float32)
+
+# Normal vocal effort, reference for the Level Distortion Factor (4.6 Eq. 11)
+_NORMAL_SPECTRUM = _EI[:, 0]
+
 
 def speech_spectrum(vocal_effort: str) -> jnp.ndarray:
   """"This function returns the standard speech spectrum level from Table 3.
@@ -62,47 +123,53 @@ def speech_spectrum(vocal_effort: str) -> jnp.ndarray:
   Returns:
     An jnp.array giving the normal spectral level versus band number.
   """
-
-  # pylint: disable=bad-whitespace  # To make it easier to read columns
-  # This is table 3 from the ANSI standard
-  ei = [[32.41, 33.81, 35.29, 30.77],
-        [34.48, 33.92, 37.76, 36.65],
-        [34.75, 38.98, 41.55, 42.5],
-        [33.98, 38.57, 43.78, 46.51],
-        [34.59, 39.11, 43.3,  47.4],
-        [34.27, 40.15, 44.85, 49.24],
-        [32.06, 38.78, 45.55, 51.21],
-        [28.3,  36.37, 44.05, 51.44],
-        [25.01, 33.86, 42.16, 51.31],
-        [23,    31.89, 40.53, 49.63],
-        [20.15, 28.58, 37.7,  47.65],
-        [17.32, 25.32, 34.39, 44.32],
-        [13.18, 22.35, 30.98, 40.8],
-        [11.55, 20.15, 28.21, 38.13],
-        [9.33,  16.78, 25.41, 34.41],
-        [5.31,  11.47, 18.35, 28.24],
-        [2.59,   7.67, 13.87, 23.45],
-        [1.13,   5.07, 11.39, 20.72]]
-  ei = jnp.array(ei)
-
   vocal_effort = vocal_effort.lower()
   if vocal_effort == 'normal':
-    return ei[:, 0]
+    return _EI[:, 0]
   elif vocal_effort == 'raised':
-    return ei[:, 1]
+    return _EI[:, 1]
   elif vocal_effort == 'loud':
-    return ei[:, 2]
+    return _EI[:, 2]
   elif vocal_effort == 'shout':
-    return ei[:, 3]
+    return _EI[:, 3]
   elif vocal_effort == 'all':
-    return ei  # For Testing
+    return _EI  # For Testing
   else:
     raise ValueError(f'Identifier string {vocal_effort} not recognized')
 
 
 band_importance_names = ['standard',  # Table 3
                          'nns', 'cid-22', 'nu6',  # All the rest from Table B.2
-                         'drt', 'spin', 'short', 'spin', 'cst']
+                         'drt', 'short', 'spin', 'cst']
+
+
+# pylint: disable=bad-whitespace  # To make it easier to read columns
+# Band-importance functions from Table 3 and Table B.2, one per column
+_BAND_IMPORTANCE = jnp.array([
+    [0.0083, 0,      0.0365, 0.0168, 0,      0.0114, 0,       0.0082],
+    [0.0095, 0,      0.0279, 0.013,  0.024,  0.0153, 0.0255,  0.0168],
+    [0.015,  0.0153, 0.0405, 0.0211, 0.033,  0.0179, 0.0256,  0.0255],
+    [0.0289, 0.0284, 0.05,   0.0344, 0.039,  0.0558, 0.036,   0.0374],
+    [0.044,  0.0363, 0.053,  0.0517, 0.0571, 0.0898, 0.0362,  0.0637],
+    [0.0578, 0.0422, 0.0518, 0.0737, 0.0691, 0.0944, 0.0514,  0.0694],
+    [0.0653, 0.0509, 0.0514, 0.0658, 0.0781, 0.0709, 0.0616,  0.0529],
+    [0.0711, 0.0584, 0.0575, 0.0644, 0.0751, 0.066,  0.077,   0.0374],
+    [0.0818, 0.0667, 0.0717, 0.0664, 0.0781, 0.0628, 0.0718,  0.0441],
+    [0.0844, 0.0774, 0.0873, 0.0802, 0.0811, 0.0672, 0.0718,  0.0784],
+    [0.0882, 0.0893, 0.0902, 0.0987, 0.0961, 0.0747, 0.1075,  0.1035],
+    [0.0898, 0.1104, 0.0938, 0.1171, 0.0901, 0.0755, 0.0921,  0.1023],
+    [0.0868, 0.112,  0.0928, 0.0932, 0.0781, 0.082,  0.1026,  0.0926],
+    [0.0844, 0.0981, 0.0678, 0.0783, 0.0691, 0.0808, 0.0922,  0.0738],
+    [0.0771, 0.0867, 0.0498, 0.0562, 0.048,  0.0483, 0.0719,  0.0596],
+    [0.0527, 0.0728, 0.0312, 0.0337, 0.033,  0.0453, 0.0461,  0.0454],
+    [0.0364, 0.0551, 0.0215, 0.0177, 0.027,  0.0274, 0.0306,  0.0365],
+    [0.0185, 0,      0.0253, 0.0176, 0.024,  0.0145, 0,       0.0275]],
+                             dtype=jnp.float32)
+
+# The columns of _BAND_IMPORTANCE, sliced once, by test number - 1 and by name
+_BAND_IMPORTANCE_BY_IDX = tuple(_BAND_IMPORTANCE[:, i] for i in range(8))
+_BAND_IMPORTANCE_BY_NAME = dict(zip(band_importance_names,
+                                    _BAND_IMPORTANCE_BY_IDX))
 
 
 def band_importance(test_number: Union[int, List[float], str,
@@ -133,43 +200,19 @@ def band_importance(test_number: Union[int, List[float], str,
     An np vector showing the importance of each band.
   """
   if isinstance(test_number, str):
-    if test_number not in band_importance_names:
+    if test_number not in _BAND_IMPORTANCE_BY_NAME:
       raise ValueError(f'Test name {test_number} not recognized, should be '
                        f'one of: {band_importance_names}')
-    else:
-      test_number = band_importance_names.index(test_number)
+    return _BAND_IMPORTANCE_BY_NAME[test_number]
 
   if isinstance(test_number, int):
     if test_number < 1 or test_number > 8:
       raise ValueError('Test number must be between 1 and 8')
+    return _BAND_IMPORTANCE_BY_IDX[test_number-1]
 
-    # pylint: disable=bad-whitespace  # To make it easier to read columns
-    band_importance_array = [
-        [0.0083, 0,      0.0365, 0.0168, 0,      0.0114, 0,       0.0082],
-        [0.0095, 0,      0.0279, 0.013,  0.024,  0.0153, 0.0255,  0.0168],
-        [0.015,  0.0153, 0.0405, 0.0211, 0.033,  0.0179, 0.0256,  0.0255],
-        [0.0289, 0.0284, 0.05,   0.0344, 0.039,  0.0558, 0.036,   0.0374],
-        [0.044,  0.0363, 0.053,  0.0517, 0.0571, 0.0898, 0.0362,  0.0637],
-        [0.0578, 0.0422, 0.0518, 0.0737, 0.0691, 0.0944, 0.0514,  0.0694],
-        [0.0653, 0.0509, 0.0514, 0.0658, 0.0781, 0.0709, 0.0616,  0.0529],
-        [0.0711, 0.0584, 0.0575, 0.0644, 0.0751, 0.066,  0.077,   0.0374],
-        [0.0818, 0.0667, 0.0717, 0.0664, 0.0781, 0.0628, 0.0718,  0.0441],
-        [0.0844, 0.0774, 0.0873, 0.0802, 0.0811, 0.0672, 0.0718,  0.0784],
-        [0.0882, 0.0893, 0.0902, 0.0987, 0.0961, 0.0747, 0.1075,  0.1035],
-        [0.0898, 0.1104, 0.0938, 0.1171, 0.0901, 0.0755, 0.0921,  0.1023],
-        [0.0868, 0.112,  0.0928, 0.0932, 0.0781, 0.082,  0.1026,  0.0926],
-        [0.0844, 0.0981, 0.0678, 0.0783, 0.0691, 0.0808, 0.0922,  0.0738],
-        [0.0771, 0.0867, 0.0498, 0.0562, 0.048,  0.0483, 0.0719,  0.0596],
-        [0.0527, 0.0728, 0.0312, 0.0337, 0.033,  0.0453, 0.0461,  0.0454],
-        [0.0364, 0.0551, 0.0215, 0.0177, 0.027,  0.0274, 0.0306,  0.0365],
-        [0.0185, 0,      0.0253, 0.0176, 0.024,  0.0145, 0,       0.0275]
-        ]
-    band_importance_array = jnp.array(band_importance_array)
-    return band_importance_array[:, test_number-1]
-  else:
-    importance = jnp.asarray(test_number)
-    if importance.shape[0] != 18:
-      raise ValueError('Supplied band importance must have 18 values')
+  importance = jnp.asarray(test_number, dtype=jnp.float32)
+  if importance.shape[0] != 18:
+    raise ValueError('Supplied band importance must have 18 values')
   return importance
 
 
@@ -219,6 +262,8 @@ def input_5p1(ssl, nsl=None, insertion_gain=None,
             parameter is valid only when ssl is specified as one of the named
             vocal efforts, i.e., according to clause (a) in the specification
             of "SSL"; it will be ignored otherwise.
+            A vector of N distances gives Nx18 results, one row per
+            distance.
 
     hearing_threshold: [dB HL] Section 3.22
             A vector with 18 numbers stating the Hearing Threshold Levels in
@@ -231,49 +276,93 @@ def input_5p1(ssl, nsl=None, insertion_gain=None,
             listening mode: b = 1 --> monaural listening, b = 2 --> binaural
             listening. Monaural listening is the default.
 
+  The spectra may also be given as arrays with leading batch dimensions,
+  e.g. Nx18 with one listening condition per row. They are broadcast against
+  each other.
+
   Returns:
     A tuple of three JAX arrays giving the speech spectrum level (ssl),
     noise spectrum level (msl) and hearing_threshold.
   """
-  if not ssl:
+  if ssl is None:
     raise ValueError('The Speech Spectrum Level, ssl, must be specified')
 
   if isinstance(ssl, str):
     ssl = speech_spectrum(ssl)  # Standard spectra are used
-    distance = distance or 1.0  # Reference communication situation assumed
+    if distance is None:
+      distance = 1.0  # Reference communication situation assumed
+    # A vector of distances gives one row of levels per distance.
+    distance = jnp.asarray(distance, dtype=jnp.float32)[..., None]
+    if not jnp.all(distance > 0):
+      raise ValueError('The distance must be positive!')
+    ssl = ssl - 20*jnp.log10(distance)
     if insertion_gain is None:
-      insertion_gain = jnp.zeros(18)
-    ssl = ssl - 20*jnp.log10(distance) + insertion_gain  # Eq. 16
+      insertion_gain = jnp.zeros_like(ssl)
+    ssl = ssl + insertion_gain  # Eq. 16
   else:
-    ssl = jnp.asarray(ssl)  # Speech Spectrum measured at listener's head
+    # Speech Spectrum measured at listener's head
+    ssl = jnp.asarray(ssl, dtype=jnp.float32)
     if insertion_gain is None:
-      insertion_gain = jnp.zeros(18)
+      insertion_gain = jnp.zeros_like(ssl)
     ssl = ssl + insertion_gain  # Eq. 17
-    if distance:
+    if distance is not None:
       warnings.warn('Distance parameter is inappropriately '
                     'specified and ignored!')
+  insertion_gain = jnp.asarray(insertion_gain, dtype=jnp.float32)
 
   # DERIVE EQUIVALENT NOISE SPECTRUM LEVEL
   if nsl is None:
-    nsl = -50*jnp.ones(18)
+    nsl = -50*jnp.ones_like(ssl)
   else:
-    nsl = jnp.asarray(nsl) + jnp.asarray(insertion_gain)  # Eq. 18
+    nsl = jnp.asarray(nsl, dtype=jnp.float32) + insertion_gain  # Eq. 18
 
   # DERIVE EQUIVALENT HEARING THRESHOLD LEVEL
   if hearing_threshold is None:
-    hearing_threshold = jnp.zeros(18)
+    hearing_threshold = jnp.zeros_like(ssl)
   else:
-    hearing_threshold = jnp.asarray(hearing_threshold)
+    hearing_threshold = jnp.asarray(hearing_threshold, dtype=jnp.float32)
 
   if num_channels != 1 and num_channels != 2:
     raise ValueError('Invalid value of num_channels specified!')
 
   if num_channels == 2:                                # Binaural listening
-    hearing_threshold -= 1.7                           # Section 5.1.5
+    hearing_threshold = hearing_threshold - 1.7        # Section 5.1.5
 
+  # Give all three spectra the same (batch) shape.
+  ssl, nsl, hearing_threshold = jnp.broadcast_arrays(ssl, nsl,
+                                                     hearing_threshold)
   return (ssl, nsl, hearing_threshold)
 
 
+@jax.jit
+def _mtf_kernel(csns, mtf) -> Tuple[jnp.ndarray, jnp.ndarray]:
+  """Apparent speech and noise spectra from the CSNSL and the MTFI.
+
+  This is the part of Sections 5.2 and 5.3 shared by input_5p2 and input_5p3,
+  which differ only in the corrections applied to the result.
+
+  Args:
+    csns: Combined Speech and Noise Spectrum Level [dB], 18 values.
+    mtf: Modulation Transfer Function for Intensity, an 18x9 matrix.
+
+  Returns:
+    A tuple of the apparent speech and apparent noise spectrum levels.
+  """
+  # Keep the MTFI strictly inside (0, 1) so the ratio in Eq. 22 stays finite
+  eps = jnp.finfo(mtf.dtype).eps
+  mtf = jnp.clip(mtf, eps, 1.0-eps)
+  # apparent speech-to-noise ratio (5.2.3.5, Eq. 22)
+  snr = _to_db(mtf / (1.0-mtf))
+  # limit to range -15 .. +15 dB
+  snr = jnp.minimum(15.0, jnp.maximum(-15.0, snr))
+  snr = jnp.mean(snr, axis=1)  # Average across modulation frequencies (5.2.3.6)
+  # Apparent speech and noise spectra (5.2.3.8 Eq. 23 and 24, which are the
+  # same as 5.3.3.3 Eq. 25 and 26)
+  esnr = snr + _to_db(_from_db(csns) / (1 + _from_db(snr)))
+  nsl = esnr - snr
+  return esnr, nsl
+
+
 def input_5p2(csns, mtf, gain=None,
               hearing_threshold=None,
               binaural=False)-> Tuple[jnp.ndarray, jnp.ndarray, jnp.ndarray]:
@@ -311,43 +400,36 @@ def input_5p2(csns, mtf, gain=None,
     A tuple of three JAX arrays giving the speech spectrum level (ssl),
     noise spectrum level (msl) and hearing_threshold.
   """
-  csns = jnp.asarray(csns)
+  csns = jnp.asarray(csns, dtype=jnp.float32)
   if csns.shape != (18,):
     raise ValueError('Combined Speech and Noise Spectrum Level: Vector size '
                      'incorrect')
 
-  mtf = jnp.asarray(mtf)
+  mtf = jnp.asarray(mtf, dtype=jnp.float32)
   if mtf.shape != (18, 9):
     raise ValueError('Modulation Transfer Function for Intensity: '
                      'Matrix size incorrect')
 
   if gain is None:
-    gain = jnp.zeros(18, dtype=float)
+    gain = jnp.zeros(18, dtype=jnp.float32)
   else:
-    gain = jnp.asarray(gain)
+    gain = jnp.asarray(gain, dtype=jnp.float32)
   if gain.shape != (18,):
     raise ValueError('Insertion Gain: Vector size incorrect')
 
   # DERIVE EQUIVALENT HEARING THRESHOLD LEVEL
   if hearing_threshold is None:
-    hearing_threshold = jnp.zeros(18, dtype=float)
+    hearing_threshold = jnp.zeros(18, dtype=jnp.float32)
   else:
-    hearing_threshold = jnp.asarray(hearing_threshold)
+    hearing_threshold = jnp.asarray(hearing_threshold, dtype=jnp.float32)
   if hearing_threshold.shape != (18,):
     raise ValueError('Hearing Threshold Level: Vector size incorrect')
 
   if binaural:  # Binaural listening
     hearing_threshold = hearing_threshold - 1.7  # Section 5.1.5
 
-  eps = jnp.finfo(float).eps
-  # apparent speech-to-noise ratio (5.2.3.5, Eq. 22)
-  snr = 10*jnp.log10((mtf+eps) / (1-mtf+eps))
-  # limit to range -15 .. +15 dB
-  snr = jnp.minimum(15.0, jnp.maximum(-15.0, snr))
-  snr = jnp.mean(snr, axis=1)  # Average across modulation frequencies (5.2.3.6)
-  # Equivalent Speech and Equivalent Noise spectra (5.2.3.8, Eq. 23
-  esnr = snr + 10*jnp.log10(10**(csns/10) / (1 + 10**(snr/10)) )
-  nsl = esnr - snr                                             # ... and Eq 24)
+  # Equivalent Speech and Equivalent Noise spectra (5.2.3.8, Eq. 23 and 24)
+  esnr, nsl = _mtf_kernel(csns, mtf)
 
   ###
   # Note: Eq. 23 and 24 represent the Equivalent Speech and Equivalent Noise
@@ -360,6 +442,16 @@ def input_5p2(csns, mtf, gain=None,
   return esnr, nsl, hearing_threshold
 
 
+# Free-field to eardrum transfer function (Table 3)
+_FF2ED_TF = jnp.asarray([0, 0.50, 1.00, 1.40, 1.50, 1.80, 2.40, 3.10, 2.60,
+                         3.00, 6.10, 12.00, 16.80, 15.00, 14.30, 10.70, 6.40,
+                         1.80],
+                        dtype=jnp.float32)
+_FF2ED_FC = jnp.asarray([160, 200, 250, 315, 400, 500, 630, 800, 1000, 1250,
+                         1600, 2000, 2500, 3150, 4000, 5000, 6300, 8000],
+                        dtype=jnp.float32)
+
+
 def ff2ed() -> Tuple[jnp.ndarray, jnp.ndarray]:
   """Free-field to eardrum transfer function.
 
@@ -369,12 +461,7 @@ def ff2ed() -> Tuple[jnp.ndarray, jnp.ndarray]:
     Blah
     Blah
   """
-
-  tf = [0, 0.50, 1.00, 1.40, 1.50, 1.80, 2.40, 3.10, 2.60, 3.00, 6.10,
-        12.00, 16.80, 15.00, 14.30, 10.70, 6.40, 1.80]
-  fc = [160, 200, 250, 315, 400, 500, 630, 800, 1000, 1250, 1600,
-        2000, 2500, 3150, 4000, 5000, 6300, 8000]
-  return jnp.asarray(tf), jnp.asarray(fc)
+  return _FF2ED_TF, _FF2ED_FC
 
 
 def input_5p3(csns, mtf, hearing_threshold=None,
@@ -408,38 +495,32 @@ def input_5p3(csns, mtf, hearing_threshold=None,
     A tuple of three JAX arrays giving the speech spectrum level (ssl),
     noise spectrum level (msl) and hearing_threshold.
   """
+  csns = jnp.asarray(csns, dtype=jnp.float32)
   if csns.shape != (18,):
     raise ValueError('Combined Speech and Noise Spectrum Level: Vector size '
                      'incorrect')
 
-  mtf = jnp.asarray(mtf)
+  mtf = jnp.asarray(mtf, dtype=jnp.float32)
   if mtf.shape != (18, 9):
     raise ValueError('Modulation Transfer Function for Intensity: '
                      'Matrix size incorrect')
 
   # DERIVE EQUIVALENT HEARING THRESHOLD LEVEL
   if hearing_threshold is None:
-    hearing_threshold = jnp.zeros(18, dtype=float)
+    hearing_threshold = jnp.zeros(18, dtype=jnp.float32)
   else:
-    hearing_threshold = jnp.asarray(hearing_threshold)
+    hearing_threshold = jnp.asarray(hearing_threshold, dtype=jnp.float32)
   if hearing_threshold.shape != (18,):
     raise ValueError('Hearing Threshold Level: Vector size incorrect')
 
   if binaural:  # Binaural listening
     hearing_threshold = hearing_threshold - 1.7  # Section 5.1.5
 
-  eps = jnp.finfo(float).eps
-  # apparent speech-to-noise ratio (5.2.3.5, Eq. 22)
-  snr = 10*jnp.log10((mtf+eps) / (1-mtf+eps))
-  snr = jnp.minimum(15, jnp.maximum(-15, snr))  # limit to range -15 ... +15 dB
-  snr = jnp.mean(snr, axis=1)  # Average across modulation frequencies (5.2.3.6)
   # APPARENT Speech and APPARENT Noise spectra (5.3.3.3, Eq. 25 and Eq 26)
-  esnr = snr + 10*jnp.log10(10**(csns/10) / (1 + 10**(snr/10)))
-  nsl = esnr - snr
+  esnr, nsl = _mtf_kernel(csns, mtf)
 
-  tf, _ = ff2ed()
-  esnr = esnr - tf  # Equivalent Speech Spectrum Level (Eq 27)
-  nsl = nsl - tf   # Equivalent Noise Spectrum Level (Eq 28)
+  esnr = esnr - _FF2ED_TF  # Equivalent Speech Spectrum Level (Eq 27)
+  nsl = nsl - _FF2ED_TF   # Equivalent Noise Spectrum Level (Eq 28)
 
   return esnr, nsl, hearing_threshold
 
@@ -498,9 +579,15 @@ def sii(ssl, nsl=None, hearing_threshold=None,
         Non_standard
         8: CST (Table 1 of Sherbecoe and Studebaker, Ear and Hearing 2003)
 
+  The three spectra may also be given as arrays with leading batch
+  dimensions, e.g. Nx18 with one listening condition per row. They are
+  broadcast against each other, so a single 18-element nsl or
+  hearing_threshold can be shared by all conditions.
+
   Returns:
     The function returns the SII of the specified listening condition, which
-    is a value in the interval [0, 1].
+    is a value in the interval [0, 1]. For batched spectra, an array of SII
+    values with the broadcast batch shape is returned.
 
   REMINDER OF DEFINITIONS & MEANINGS:
 
@@ -539,38 +626,70 @@ def sii(ssl, nsl=None, hearing_threshold=None,
   """
   ################# VERIFY INTEGRITY OF INPUT VARIABLES ######################
 
-  ssl = jnp.asarray(ssl)
+  ssl = jnp.asarray(ssl, dtype=jnp.float32)
   if nsl is None:
-    nsl = -50*jnp.ones(18)
+    nsl = -50*jnp.ones(18, dtype=jnp.float32)
   else:
-    nsl = jnp.asarray(nsl)
+    nsl = jnp.asarray(nsl, dtype=jnp.float32)
 
   if hearing_threshold is None:
-    hearing_threshold = jnp.zeros(18)
+    hearing_threshold = jnp.zeros(18, dtype=jnp.float32)
   else:
-    hearing_threshold = jnp.asarray(hearing_threshold)
+    hearing_threshold = jnp.asarray(hearing_threshold, dtype=jnp.float32)
 
-  if nsl.shape != (18,):
+  if nsl.shape[-1:] != (18,):
     raise ValueError('Equivalent Noise Spectrum Level: Vector size incorrect')
-  if hearing_threshold.shape != (18,):
+  if hearing_threshold.shape[-1:] != (18,):
     raise ValueError('Equivalent Hearing Threshold Level: '
                      'Vector size incorrect')
-  if ssl.shape != (18,):
+  if ssl.shape[-1:] != (18,):
     raise ValueError('Equivalent Speech Spectrum Level: Vector size incorrect')
 
+  if isinstance(band_importance_function, bool):
+    raise ValueError('Band importance must be a test number, name or vector')
+  test_number = None
+  if isinstance(band_importance_function, (int, np.integer)):
+    test_number = int(band_importance_function)
+    if test_number < 1 or test_number > 8:
+      raise ValueError('Test number must be between 1 and 8')
+    importance = _BAND_IMPORTANCE_BY_IDX[test_number-1]
+  else:
+    importance = band_importance(band_importance_function)
+
+  batch_shape = jnp.broadcast_shapes(ssl.shape, nsl.shape,
+                                     hearing_threshold.shape)[:-1]
+  if batch_shape:
+    # Flatten the batch dimensions into rows for the vmapped kernel.
+    ssl, nsl, hearing_threshold = [
+        jnp.broadcast_to(x, batch_shape + (18,)).reshape(-1, 18)
+        for x in (ssl, nsl, hearing_threshold)]
+    return _sii_core_batch(ssl, nsl, hearing_threshold,
+                           importance).reshape(batch_shape)
+  if test_number is not None:
+    # Compile the standard band-importance function in as a constant.
+    return _sii_standard(ssl, nsl, hearing_threshold,
+                         band_importance_function=test_number)
+  return _sii_core(ssl, nsl, hearing_threshold, importance)
+
+
+@jax.jit
+def _sii_core(ssl, nsl, hearing_threshold, importance) -> jnp.ndarray:
+  """Section 4 of the standard, on already validated 18-band vectors.
+
+  Args:
+    ssl: Equivalent Speech Spectrum Level, 18 values in dB.
+    nsl: Equivalent Noise Spectrum Level, 18 values in dB.
+    hearing_threshold: Equivalent Hearing Threshold Level, 18 values in dBHL.
+    importance: The band-importance function, 18 weights.
+
+  Returns:
+    The SII as a JAX scalar.
+  """
   ################# IMPLEMENTATION OF SPEECH INTELLIGIBILITY INDEX ############
 
   # THE NUMBERS IN PARENTHESIS REFER TO THE SECTIONS IN THE ANSI STANDARD
   # pylint: disable=invalid-name  # variable names are from the standard
 
-  # Define band center frequencies for 1/3rd octave procedure (Table 3)
-  f = jnp.array([160, 200, 250, 315, 400, 500, 630, 800, 1000, 1250, 1600, 2000,
-                 2500, 3150, 4000, 5000, 6300, 8000])
-
-  # Define Internal Noise Spectrum Level (Table 3)
-  X = jnp.array([0.6, -1.7, -3.9, -6.1, -8.2, -9.7, -10.8, -11.9, -12.5,
-                 -13.5, -15.4, -17.7, -21.2, -24.2, -25.9, -23.6, -15.8, -7.1])
-
   # Self-Speech Masking Spectrum (4.3.2.1 Eq. 5)
   V = ssl - 24
 
@@ -578,26 +697,31 @@ def sii(ssl, nsl=None, hearing_threshold=None,
   B = jnp.maximum(V, nsl)
 
   # Calculate slope parameter Ci (4.3.2.3 Eq. 7)
-  C = 0.6*(B + 10*jnp.log10(f) - 6.353) - 80
-
+  C = 0.6*(B + _to_db(_F) - 6.353) - 80
+
+  # Calculate Equivalent Masking Spectrum Level (4.3.2.5 Eq. 9) for all bands
+  # at once. Row i of the masking matrix holds the spread of masking into band
+  # i from each of the lower bands j < i; all other entries are masked out.
+  # Eq. 9 uses only B and C of the lower bands, never their Z, so the bands do
+  # not form a recurrence and need no sequential loop (e.g. jax.lax.scan).
+  # The power sum is done in the natural-log domain with logsumexp/logaddexp,
+  # which does not overflow for large levels. Band 0 has no lower bands and
+  # is left out, so that no row of the logsumexp is entirely masked.
+  log_terms = ((0.1*_LOG10)*(B[None, :] + C[None, :]*_MIJ[1:]) +
+               _LOG_LOWER_MASK[1:])
+  Z = (10.0*_INV_LOG10)*jnp.logaddexp((0.1*_LOG10)*nsl[1:],
+                                      jax.nn.logsumexp(log_terms, axis=1))
   # Initialize Equivalent Masking Spectrum Level (4.3.2.4)
-  # Z = jnp.zeros(18)
-  # Z[0] = B[0]
-  Z = [B[0],]
-  # Calculate Equivalent Masking Spectrum Level (4.3.2.5 Eq. 9)
-  for i in range(1, 18):
-    Z.append(10*jnp.log10(10**(0.1*nsl[i]) +
-                          jnp.sum(10**(0.1*(B[:i] + 3.32*C[:i]*
-                                            jnp.log10(0.89*f[i]/f[:i]))))))
-  Z = jnp.asarray(Z)
+  Z = jnp.concatenate([B[:1], Z])
+
   # Equivalent Internal Noise Spectrum Level (4.4 Eq. 10)
-  X = X + hearing_threshold
+  X = _X + hearing_threshold
 
   # Disturbance Spectrum Level (4.5)
   D = jnp.maximum(Z, X)
 
   # Level Distortion Factor (4.6 Eq. 11)
-  L = 1 - (ssl - speech_spectrum('normal') - 10)/160
+  L = 1 - (ssl - _NORMAL_SPECTRUM - 10)/160
   L = jnp.minimum(1, L)
 
   # 4.7.1 Eq. 12
@@ -608,4 +732,98 @@ def sii(ssl, nsl=None, hearing_threshold=None,
   A = L*K
 
   # Speech Intelligibility Index (4.8 Eq. 14)
-  return jnp.sum(band_importance(band_importance_function)*A)
+  return jnp.sum(importance*A)
+
+
+@functools.partial(jax.jit, static_argnames=('band_importance_function',))
+def _sii_standard(ssl, nsl, hearing_threshold,
+                  band_importance_function: int) -> jnp.ndarray:
+  """_sii_core for one of the 8 numbered band-importance functions."""
+  return _sii_core(ssl, nsl, hearing_threshold,
+                   _BAND_IMPORTANCE_BY_IDX[band_importance_function-1])
+
+
+_sii_core_batch = jax.jit(jax.vmap(_sii_core, in_axes=(0, 0, 0, None)))
+
+
+def sii_batch(ssl, nsl=None, hearing_threshold=None,
+              band_importance_function: int = 1) -> jnp.ndarray:
+  """Compute the SII for a batch of listening conditions in one call.
+
+  This is the same calculation as the sii function, vectorized over a leading
+  batch dimension so that a sweep over distances, noise levels or hearing
+  thresholds runs as a single compiled computation.
+
+  Args:
+    ssl: Equivalent Speech Spectrum Level, an Nx18 array with one condition
+      per row.
+    nsl: Equivalent Noise Spectrum Level, either an Nx18 array or a single
+      18-element vector shared by all conditions. Defaults to -50 dB in all
+      bands.
+    hearing_threshold: Equivalent Hearing Threshold Level [dBHL], either an
+      Nx18 array or a single 18-element vector shared by all conditions.
+      Defaults to 0 dBHL in all bands.
+    band_importance_function: The band-importance function used for every
+      condition, specified as for the sii function.
+
+  Returns:
+    A vector with the N SII values.
+  """
+  ssl = jnp.asarray(ssl, dtype=jnp.float32)
+  if ssl.ndim != 2 or ssl.shape[1] != 18:
+    raise ValueError('Equivalent Speech Spectrum Level: Matrix size incorrect')
+
+  if nsl is None:
+    nsl = -50*jnp.ones(18, dtype=jnp.float32)
+  nsl = jnp.asarray(nsl, dtype=jnp.float32)
+  if nsl.shape != (18,) and nsl.shape != ssl.shape:
+    raise ValueError('Equivalent Noise Spectrum Level: Matrix size incorrect')
+
+  if hearing_threshold is None:
+    hearing_threshold = jnp.zeros(18, dtype=jnp.float32)
+  hearing_threshold = jnp.asarray(hearing_threshold, dtype=jnp.float32)
+  if (hearing_threshold.shape != (18,) and
+      hearing_threshold.shape != ssl.shape):
+    raise ValueError('Equivalent Hearing Threshold Level: '
+                     'Matrix size incorrect')
+
+  return _sii_core_batch(ssl,
+                         jnp.broadcast_to(nsl, ssl.shape),
+                         jnp.broadcast_to(hearing_threshold, ssl.shape),
+                         band_importance(band_importance_function))
+
+
+def precompile(cache_dir: Optional[str] = None) -> None:
+  """Compile the SII kernels for single 18-band conditions ahead of time.
+
+  Otherwise the first calls to sii, input_5p2 and input_5p3 in a process pay
+  for tracing and XLA compilation. Calling this once at program start moves
+  that cost out of the first evaluation. It compiles sii for each of the 8
+  numbered band-importance functions and for named or custom ones.
+
+  Args:
+    cache_dir: Optional directory, e.g. '~/.cache/sii_jax_xla', for JAX's
+      persistent compilation cache, so that later Python processes load the
+      compiled kernels from disk instead of compiling them again. Note that
+      this sets the cache directory for all of JAX in this process.
+  """
+  if cache_dir:
+    jax.config.update('jax_compilation_cache_dir',
+                      os.path.expanduser(cache_dir))
+    # The SII kernels compile in well under a second, which is below the
+    # default threshold for writing an executable to the cache.
+    jax.config.update('jax_persistent_cache_min_compile_time_secs', 0)
+
+  # Run the public functions on dummy inputs. This fills the same caches that
+  # later calls look up, including those of the small operations outside the
+  # jitted kernels, such as building the default spectra and converting NumPy
+  # inputs. Only lowering and compiling the kernels (.lower().compile()) does
+  # not.
+  ssl = np.zeros(18)
+  for band_importance_function in range(1, len(band_importance_names) + 1):
+    sii(ssl, band_importance_function=band_importance_function
+       ).block_until_ready()
+  # Band-importance names and custom vectors share one compiled kernel.
+  sii(ssl, band_importance_function=np.full(18, 1/18)).block_until_ready()
+  jax.block_until_ready(input_5p2(np.zeros(18), np.zeros((18, 9))))
+  jax.block_until_ready(input_5p3(np.zeros(18), np.zeros((18, 9))))
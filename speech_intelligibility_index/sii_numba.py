@@ -0,0 +1,188 @@
+# Copyright 2023 The speech_intelligibility_index Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Numba implementation of ANSI S3.5-1997  - Speech Intelligibility Index.
+
+This module provides the core SII calculation of Section 4 (one-third octave
+band procedure) compiled with Numba, for CPU-only deployments that do not have
+JAX installed. The input spectra can be computed with the input_5p1, input_5p2
+or input_5p3 functions from sii.py, which also provides the band-importance
+functions and the standard speech spectra used here.
+
+Original Matlab Version Copyright 2003-2005 Hannes Muesch
+Translation to Matlab by Malcolm Slaney, Google Sound Understanding Team
+
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from typing import List, Union
+
+import numba
+import numpy as np
+
+import sii as sii_numpy
+
+
+# Band center frequencies for the 1/3rd octave procedure (Table 3)
+_F = np.array([160, 200, 250, 315, 400, 500, 630, 800, 1000, 1250, 1600, 2000,
+               2500, 3150, 4000, 5000, 6300, 8000], dtype=np.float64)
+
+# Internal Noise Spectrum Level (Table 3)
+_X = np.array([0.6, -1.7, -3.9, -6.1, -8.2, -9.7, -10.8, -11.9, -12.5,
+               -13.5, -15.4, -17.7, -21.2, -24.2, -25.9, -23.6, -15.8, -7.1])
+
+# Standard speech spectrum level for normal vocal effort (Table 3)
+_NORMAL_SPECTRUM = np.asarray(sii_numpy.speech_spectrum('normal'),
+                              dtype=np.float64)
+
+# Spread of masking from band j into band i (4.3.2.5 Eq. 9), used for j < i.
+_MIJ = 3.32*np.log10(0.89*_F[:, None]/_F[None, :])
+
+
+@numba.njit(cache=True, fastmath=True)
+def _sii_core(ssl, nsl, hearing_threshold, importance,
+              f, x, normal_spectrum, mij):
+  """Section 4 of the standard, on already validated float64 18-band vectors.
+
+  The tables from Table 3 are passed in explicitly so that Numba compiles a
+  single specialization of this function.
+  """
+  # pylint: disable=invalid-name  # variable names are from the standard
+  n = ssl.shape[0]
+
+  # Self-Speech Masking Spectrum (4.3.2.1 Eq. 5) and 4.3.2.2
+  B = np.maximum(ssl - 24, nsl)
+
+  # Calculate slope parameter Ci (4.3.2.3 Eq. 7)
+  C = 0.6*(B + 10*np.log10(f) - 6.353) - 80
+
+  # Initialize Equivalent Masking Spectrum Level (4.3.2.4)
+  Z = np.empty(n)
+  Z[0] = B[0]
+
+  # Calculate Equivalent Masking Spectrum Level (4.3.2.5 Eq. 9)
+  for i in range(1, n):
+    total = 10**(0.1*nsl[i])
+    for j in range(i):
+      total += 10**(0.1*(B[j] + C[j]*mij[i, j]))
+    Z[i] = 10*np.log10(total)
+
+  index = 0.0
+  for i in range(n):
+    # Disturbance Spectrum Level (4.5), using the Equivalent Internal Noise
+    # Spectrum Level (4.4 Eq. 10)
+    D = max(Z[i], x[i] + hearing_threshold[i])
+    # Level Distortion Factor (4.6 Eq. 11)
+    L = min(1.0, 1 - (ssl[i] - normal_spectrum[i] - 10)/160)
+    # 4.7.1 Eq. 12
+    K = min(1.0, max(0.0, (ssl[i] - D + 15)/30))
+    # Band Audibility Function (7.7.2 Eq. 13) and the Speech Intelligibility
+    # Index (4.8 Eq. 14)
+    index += importance[i]*L*K
+  return index
+
+
+@numba.njit(cache=True, fastmath=True)
+def _sii_rows(ssl, nsl, hearing_threshold, importance,
+              f, x, normal_spectrum, mij):
+  """_sii_core for each row of Nx18 float64 arrays."""
+  result = np.empty(ssl.shape[0])
+  for row in range(ssl.shape[0]):
+    result[row] = _sii_core(ssl[row], nsl[row], hearing_threshold[row],
+                            importance, f, x, normal_spectrum, mij)
+  return result
+
+
+def sii(ssl, nsl=None, hearing_threshold=None,
+        band_importance_function: Union[int, List[float], str,
+                                        np.ndarray] = 1
+        ) -> Union[float, np.ndarray]:
+  """Compute the speech intelligibility index according to the ANSI standard.
+
+  This is a Numba compiled version of the sii function in sii.py, and takes
+  the same arguments, including batches of spectra. The first call in a
+  process compiles the core (or loads it from Numba's on-disk cache), later
+  calls run without interpreter overhead.
+
+  Args:
+    ssl: Equivalent Speech Spectrum Level (Section 3.6 in the standard)
+      A vector of 18 numbers stating the Equivalent Speech Spectrum Levels
+      in dB in bands 1 through 18.
+    nsl: Equivalent Noise Spectrum Level (Section 3.15 in the standard)
+      A vector of 18 numbers stating the Equivalent Noise Spectrum Levels in
+      dB in bands 1 through 18. Defaults to -50 dB in all 18 bands.
+    hearing_threshold: Equivalent Hearing Threshold Level [dBHL]
+      (Section 3.23 in the standard)
+      A vector of 18 numbers stating the Equivalent Hearing Threshold Levels
+      in dBHL in bands 1 through 18. Defaults to 0 dBHL in all 18 bands.
+    band_importance_function: Section 3.1 in the standard
+      A scalar between 1 and 8 or a name, selecting one of the
+      band-importance functions listed in sii.band_importance, or the desired
+      band importance as an 18-element vector.
+
+  The three spectra may also be given as arrays with leading batch
+  dimensions, e.g. Nx18 with one listening condition per row. They are
+  broadcast against each other.
+
+  Returns:
+    The SII of the specified listening condition, a value in the interval
+    [0, 1]. For batched spectra, an array of SII values with the broadcast
+    batch shape is returned.
+  """
+  ssl = np.asarray(ssl, dtype=np.float64)
+  if nsl is None:
+    nsl = -50*np.ones(18)
+  else:
+    nsl = np.asarray(nsl, dtype=np.float64)
+
+  if hearing_threshold is None:
+    hearing_threshold = np.zeros(18)
+  else:
+    hearing_threshold = np.asarray(hearing_threshold, dtype=np.float64)
+
+  if nsl.shape[-1:] != (18,):
+    raise ValueError('Equivalent Noise Spectrum Level: Vector size incorrect')
+  if hearing_threshold.shape[-1:] != (18,):
+    raise ValueError('Equivalent Hearing Threshold Level: '
+                     'Vector size incorrect')
+  if ssl.shape[-1:] != (18,):
+    raise ValueError('Equivalent Speech Spectrum Level: Vector size incorrect')
+
+  importance = np.ascontiguousarray(
+      sii_numpy.band_importance(band_importance_function), dtype=np.float64)
+
+  batch_shape = np.broadcast_shapes(ssl.shape, nsl.shape,
+                                    hearing_threshold.shape)[:-1]
+  if not batch_shape:
+    return float(_sii_core(ssl, nsl, hearing_threshold, importance,
+                           _F, _X, _NORMAL_SPECTRUM, _MIJ))
+  # Flatten the batch dimensions into contiguous rows for the compiled loop.
+  ssl, nsl, hearing_threshold = [
+      np.ascontiguousarray(np.broadcast_to(x, batch_shape + (18,)).reshape(
+          -1, 18))
+      for x in (ssl, nsl, hearing_threshold)]
+  return _sii_rows(ssl, nsl, hearing_threshold, importance,
+                   _F, _X, _NORMAL_SPECTRUM, _MIJ).reshape(batch_shape)
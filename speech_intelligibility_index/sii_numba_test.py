@@ -0,0 +1,114 @@
+# Copyright 2023 The speech_intelligibility_index Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the Numba version of the SII code.
+
+Copyright 2022 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from absl.testing import absltest
+import numpy as np
+
+import sii
+import sii_numba
+
+
+class ChasTest(absltest.TestCase):
+  """These tests come from Chas' original C code."""
+
+  @classmethod
+  def setUpClass(cls):
+    super().setUpClass()
+    # The listening condition shared by both tests.
+    cls.ssl = np.array([90, 5, 40, 40, 40, 40, 40, 40, 40, 40,
+                        40, 40, 40, 40, -10, -10, -10, -10], dtype=np.float64)
+    cls.nsl = np.array([10, -10, -10, 75, -10, -10, -10, -10, -10,
+                        -10, -10, -10, -10, -10, 10, 10, 10, 10],
+                       dtype=np.float64)
+    cls.thresh = np.array([90, 0, 0, 0, 0, 0, 0, 0, 0,
+                           0, 0, 0, 0, 0, 0, 0, 0, 0], dtype=np.float64)
+
+  def test_to(self):
+    """1/3-Octave Procedure."""
+    result = sii_numba.sii(ssl=self.ssl, nsl=self.nsl,
+                           hearing_threshold=self.thresh)
+    np.testing.assert_allclose(result, .445, atol=1e-3)
+
+  def test_to_1(self):
+    """1/3-Octave Procedure with alternative band importance function."""
+    importance = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0.1, 0.1,
+                  0.1, 0.1, 0.1, 0.1, 0.1, 0.3, 0]
+
+    result = sii_numba.sii(ssl=self.ssl, nsl=self.nsl,
+                           hearing_threshold=self.thresh,
+                           band_importance_function=importance)
+    np.testing.assert_allclose(result, .438, atol=1e-3)
+
+
+class NumpyComparisonTest(absltest.TestCase):
+
+  def test_matches_numpy(self):
+    """The Numba core must agree with sii.py for every importance function."""
+    for vocal_effort in ('normal', 'raised', 'loud', 'shout'):
+      for noise_level in (-50, 20, 40, 60):
+        ssl, nsl, hearing_threshold = sii.input_5p1(ssl=vocal_effort,
+                                                    nsl=noise_level*np.ones(18),
+                                                    num_channels=2)
+        for band_importance_function in range(1, 9):
+          expected = sii.sii(ssl=ssl, nsl=nsl,
+                             hearing_threshold=hearing_threshold,
+                             band_importance_function=band_importance_function)
+          result = sii_numba.sii(
+              ssl=ssl, nsl=nsl, hearing_threshold=hearing_threshold,
+              band_importance_function=band_importance_function)
+          np.testing.assert_allclose(result, expected, atol=1e-9)
+
+  def test_names_and_batches(self):
+    """Band-importance names and batched spectra work as in sii.py."""
+    ssl = np.stack([sii.speech_spectrum(effort)
+                    for effort in ('normal', 'raised', 'loud', 'shout')])
+    nsl = 30*np.ones(18)
+    for name in sii.band_importance_names:
+      expected = sii.sii(ssl=ssl, nsl=nsl, band_importance_function=name)
+      result = sii_numba.sii(ssl=ssl, nsl=nsl, band_importance_function=name)
+      self.assertEqual(result.shape, (4,))
+      np.testing.assert_allclose(result, expected, atol=1e-9)
+
+    result = sii_numba.sii(ssl=ssl.reshape(2, 2, 18), nsl=nsl)
+    np.testing.assert_allclose(result, sii.sii(ssl=ssl, nsl=nsl).reshape(2, 2),
+                               atol=1e-9)
+
+  def test_bad_sizes(self):
+    with self.assertRaises(ValueError):
+      sii_numba.sii(ssl=np.zeros(17))
+    with self.assertRaises(ValueError):
+      sii_numba.sii(ssl=np.zeros(18), band_importance_function=9)
+    with self.assertRaises(ValueError):
+      sii_numba.sii(ssl=np.zeros(18), band_importance_function='unknown')
+
+
+if __name__ == '__main__':
+  absltest.main()